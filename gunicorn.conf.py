@@ -0,0 +1,19 @@
+"""
+Gunicorn configuration for spotify_recommender.
+
+Run with: gunicorn -c gunicorn.conf.py spotify_recommender.wsgi
+"""
+
+wsgi_app = 'spotify_recommender.wsgi:application'
+
+
+def post_worker_init(worker):
+    """
+    Warm the worker up after the fork, so sockets are never shared with
+    the master or other workers (safe with --preload).
+    """
+    from django.conf import settings
+
+    if settings.STARTUP_WARMUP:
+        from recommender.warmup import warm_up
+        warm_up()
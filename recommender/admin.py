@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import UserProfile, RecommendationHistory
+from .models import UserProfile, RecommendationHistory, Track
 
 admin.site.register(UserProfile)
-admin.site.register(RecommendationHistory)
\ No newline at end of file
+admin.site.register(RecommendationHistory)
+admin.site.register(Track)
\ No newline at end of file
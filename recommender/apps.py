@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class RecommenderConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'recommender'
\ No newline at end of file
+    name = 'recommender'
+
+    def ready(self):
+        from .recommendation.engine import MoodMusicRecommender
+        MoodMusicRecommender.prepare()
+
+        # Only fork-safe work happens here: under gunicorn --preload this runs
+        # in the master. The connection pool is opened per worker by the
+        # post_worker_init hook in gunicorn.conf.py.
+        if settings.STARTUP_WARMUP:
+            from .warmup import precompile_templates
+            precompile_templates()
@@ -0,0 +1,24 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+class ProfileModelBackend(ModelBackend):
+    """
+    Model backend that loads the user's UserProfile in the same query as
+    the user, so request.user.userprofile never needs a second round-trip.
+    """
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        user = UserModel._default_manager.select_related('userprofile').filter(pk=user_id).first()
+        return user if user and self.user_can_authenticate(user) else None
+
+
+def get_request_profile(request):
+    """
+    Return the UserProfile of the logged in user.
+
+    The profile is cached on request.user, which Django memoizes for the
+    rest of the request. Raises UserProfile.DoesNotExist if the user has
+    not connected Spotify yet.
+    """
+    return request.user.userprofile
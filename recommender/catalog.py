@@ -0,0 +1,165 @@
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'AVACAT1\n'
+# Payload length and track id length, followed by the id and the JSON payload
+RECORD_HEADER = struct.Struct('<IB')
+
+
+class TrackCatalog:
+    """
+    Deduplicated, host-wide cache of track metadata.
+
+    The catalog is an append-only file: a magic header followed by
+    records, each holding a track id and the track as compact JSON. Every worker process memory-maps the same file, so track metadata
+    lives once in the page cache instead of once per worker per user. Each
+    process keeps only a track id -> offset index, which it extends by
+    scanning records appended since its last look. Appends are serialized
+    with flock, and a record left half-written by a killed writer is cut
+    off before the next append. A track whose metadata changed (e.g.
+    popularity) is appended again and the newest record wins.
+
+    The database (models.Track) is the source of truth; losing the file
+    only costs refilling it from there.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._scanned = len(MAGIC)
+        self._offsets = {}
+
+    def get(self, track_id):
+        """
+        Return the track dict for track_id, or None if it isn't catalogued.
+        """
+        with self._lock:
+            self._refresh()
+            offset = self._offsets.get(track_id)
+            if offset is None:
+                return None
+            return self._read(offset)
+
+    def get_many(self, track_ids):
+        """
+        Return the track dicts for track_ids, in order, with None for ids
+        that aren't catalogued.
+        """
+        with self._lock:
+            self._refresh()
+            return [
+                self._read(self._offsets[track_id]) if track_id in self._offsets else None
+                for track_id in track_ids
+            ]
+
+    def add_many(self, tracks):
+        """
+        Add track dicts that aren't catalogued yet or whose metadata
+        changed. Returns their ids.
+        """
+        with self._lock, open(self.path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if f.tell() == 0:
+                    f.write(MAGIC)
+                    f.flush()
+                # Pick up what other processes appended before deciding what's new
+                self._refresh()
+                size = os.fstat(f.fileno()).st_size
+                if size > self._scanned:
+                    # Appends are serialized, so an unparsed tail is a record a
+                    # killed writer left half-written; records appended after
+                    # it would be misread, so cut it off first
+                    logger.warning(
+                        "Track catalog %s has a %d byte partial record; truncating",
+                        self.path, size - self._scanned
+                    )
+                    f.truncate(self._scanned)
+                records = []
+                new_ids = set()
+                for track in tracks:
+                    if track['id'] in new_ids:
+                        continue
+                    if track['id'] in self._offsets and self._read(self._offsets[track['id']]) == track:
+                        continue
+                    new_ids.add(track['id'])
+                    track_id = track['id'].encode('utf-8')
+                    data = json.dumps(track, separators=(',', ':')).encode('utf-8')
+                    records.append(RECORD_HEADER.pack(len(data), len(track_id)) + track_id + data)
+                if records:
+                    f.write(b''.join(records))
+                    f.flush()
+                    self._refresh()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return [track['id'] for track in tracks]
+
+    def __contains__(self, track_id):
+        return self.get(track_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._offsets)
+
+    def _refresh(self):
+        """
+        Remap the file if it grew and index the records appended since.
+        Runs before every read: one stat() picks up newer records from other
+        workers and stops us reading a truncated mapping (SIGBUS).
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size < self._scanned:
+            # Truncated or replaced underneath us; offsets no longer hold
+            logger.error("Track catalog %s shrank from %d to %d bytes; reindexing", self.path, self._scanned, size)
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = None
+            self._offsets = {}
+            self._scanned = len(MAGIC)
+        if size <= self._scanned:
+            return
+
+        if self._mmap is None or len(self._mmap) < size:
+            with open(self.path, 'rb') as f:
+                new_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = new_mmap
+            if self._mmap[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{self.path} is not a track catalog")
+
+        position = self._scanned
+        # The mapping can outlast a torn tail that was since truncated;
+        # never read past the end of the file
+        end = min(len(self._mmap), size)
+        while position + RECORD_HEADER.size <= end:
+            length, id_length = RECORD_HEADER.unpack_from(self._mmap, position)
+            start = position + RECORD_HEADER.size
+            if start + id_length + length > end:
+                break  # Partially written record; pick it up next time
+            track_id = self._mmap[start:start + id_length].decode('utf-8')
+            self._offsets[track_id] = position
+            position = start + id_length + length
+        self._scanned = position
+
+    def _read(self, offset):
+        length, id_length = RECORD_HEADER.unpack_from(self._mmap, offset)
+        start = offset + RECORD_HEADER.size + id_length
+        return json.loads(self._mmap[start:start + length])
+
+
+track_catalog = TrackCatalog(settings.TRACK_CATALOG_PATH)
@@ -0,0 +1,156 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, DataError, IntegrityError, close_old_connections, transaction
+
+from .models import RecommendationHistory
+
+
+logger = logging.getLogger(__name__)
+
+
+def _is_transient(error):
+    """
+    Whether a failed write may succeed if retried, e.g. ``database is locked``.
+    Constraint and data errors mean the record itself is bad.
+    """
+    return isinstance(error, DatabaseError) and not isinstance(error, (IntegrityError, DataError))
+
+
+class HistoryWriteBuffer:
+    """
+    Write-behind buffer for RecommendationHistory records.
+
+    Records are queued in memory and written with a single bulk_create
+    once the buffer holds ``max_size`` records or ``flush_interval``
+    seconds have passed, so concurrent requests don't each take the
+    SQLite write lock.
+
+    Records that fail for transient reasons (e.g. ``database is locked``)
+    are queued again and retried with an exponential backoff of up to
+    ``max_backoff`` seconds; only records the database rejects are dropped.
+    Each process has its own buffer, so a record queued in one worker isn't
+    visible to the others until that worker flushes it.
+    """
+    def __init__(self, max_size=50, flush_interval=2.0, max_backoff=30.0):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self._backoff = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    def add(self, history):
+        """
+        Queue a history record for writing.
+        """
+        with self._lock:
+            self._pending.append(history)
+            full = len(self._pending) >= self.max_size
+            self._ensure_thread()
+        # While backing off, a full buffer waits for the retry like the rest
+        if full and not self._backoff:
+            self._wakeup.set()
+        return history
+
+    def flush(self):
+        """
+        Write all queued records to the database. Records that couldn't be
+        written for transient reasons are queued again. Returns the number
+        of records taken from the queue.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if batch:
+                try:
+                    with transaction.atomic():
+                        RecommendationHistory.store_new_tracks(batch)
+                        RecommendationHistory.objects.bulk_create(batch, batch_size=self.max_size)
+                except Exception as e:
+                    if _is_transient(e):
+                        logger.warning("Bulk insert of %d history records failed; retrying", len(batch), exc_info=True)
+                        self._requeue(batch)
+                    else:
+                        logger.exception("Bulk insert of %d history records failed; saving one by one", len(batch))
+                        self._requeue(self._save_each(batch))
+                else:
+                    for history in batch:
+                        history._new_tracks = []
+                    self._backoff = 0
+        return len(batch)
+
+    def _save_each(self, batch):
+        """
+        Save records individually so one bad record can't block the rest.
+        Records the database rejects are logged and dropped. Returns the
+        records left unsaved by a transient error.
+        """
+        for i, history in enumerate(batch):
+            try:
+                history.save(force_insert=True)
+            except Exception as e:
+                if _is_transient(e):
+                    logger.warning("Saving history record %s failed; retrying", history.key, exc_info=True)
+                    return batch[i:]
+                logger.exception("Dropping history record %s (%r)", history.key, history.prompt)
+        self._backoff = 0
+        return []
+
+    def _requeue(self, batch):
+        if not batch:
+            return
+        with self._lock:
+            # Keep the original order ahead of anything queued meanwhile
+            self._pending[:0] = batch
+        self._backoff = min(max(self._backoff * 2, self.flush_interval), self.max_backoff)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self):
+        """
+        Stop the background thread and flush whatever is left.
+        """
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        lost = self.pending_count()
+        if lost:
+            logger.error("Shutting down with %d unsaved history records", lost)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(
+                target=self._run, name='history-write-buffer', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self._backoff or self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing recommendation history")
+            finally:
+                # This thread owns its own DB connection; don't let it go stale
+                close_old_connections()
+
+
+history_buffer = HistoryWriteBuffer(
+    max_size=settings.HISTORY_BUFFER_SIZE,
+    flush_interval=settings.HISTORY_FLUSH_INTERVAL,
+)
+atexit.register(history_buffer.shutdown)
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from recommender.catalog import TrackCatalog
+from recommender.models import RecommendationHistory, Track
+
+
+class Command(BaseCommand):
+    help = "Benchmark history page render time against history size, with cold and warm fragment caches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500], help="History entries to render")
+        parser.add_argument('--tracks', type=int, default=15, help="Tracks per entry")
+        parser.add_argument('--repeat', type=int, default=3, help="Warm renders to average")
+
+    def handle(self, *args, **options):
+        # Throwaway user; deleting it at the end removes every record written
+        user = User.objects.create(username=f'bench_render_{int(time.time())}')
+        tracks = [
+            {
+                'id': f'bench{i}',
+                'name': f'Bench Track {i}',
+                'uri': f'spotify:track:bench{i}',
+                'artists': [{'id': 'bench', 'name': 'Bench Artist'}],
+                'album': {'id': 'bench', 'name': 'Bench Album', 'release_date': None},
+                'popularity': 50,
+                'preview_url': None,
+                'image_url': None
+            }
+            for i in range(options['tracks'])
+        ]
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user, backend='recommender.backends.ProfileModelBackend')
+        keys = []
+        # Bench tracks go to a throwaway catalog, since the real one is
+        # append-only, and their Track rows are deleted at the end
+        catalog_dir = tempfile.TemporaryDirectory()
+        catalog = TrackCatalog(os.path.join(catalog_dir.name, 'catalog.bin'))
+        patch = mock.patch('recommender.models.track_catalog', catalog)
+        patch.start()
+        try:
+            for size in sorted(options['sizes']):
+                while len(keys) < size:
+                    history = RecommendationHistory(user=user, prompt='bench')
+                    history.set_tracks(tracks)
+                    history.save()
+                    keys.append(history.key)
+                cache.delete_many([make_template_fragment_key('history_entry', [key]) for key in keys])
+
+                cold = self._render(client)
+                warm = sum(self._render(client) for _ in range(options['repeat'])) / options['repeat']
+                self.stdout.write(
+                    f"{size:>6} entries: cold {cold * 1000:.0f}ms, warm {warm * 1000:.0f}ms"
+                )
+        finally:
+            cache.delete_many([make_template_fragment_key('history_entry', [key]) for key in keys])
+            client.logout()
+            user.delete()
+            Track.objects.filter(id__in=[track['id'] for track in tracks]).delete()
+            patch.stop()
+            catalog_dir.cleanup()
+
+    def _render(self, client):
+        started = time.perf_counter()
+        response = client.get('/history/')
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f"/history/ returned {response.status_code}")
+        return elapsed
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from recommender.catalog import TrackCatalog
+from recommender.history_buffer import HistoryWriteBuffer
+from recommender.models import RecommendationHistory, Track
+
+
+class Command(BaseCommand):
+    help = "Benchmark recommendation history write throughput under concurrent load."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--records', type=int, default=100, help="Records written per thread")
+        parser.add_argument('--tracks', type=int, default=15, help="Tracks per record")
+        parser.add_argument('--buffer-size', type=int, default=50)
+
+    def handle(self, *args, **options):
+        # Throwaway user; deleting it at the end removes every record written
+        user = User.objects.create(username=f'bench_history_{int(time.time())}')
+        tracks = [
+            {
+                'id': f'bench{i}',
+                'name': f'Bench Track {i}',
+                'uri': f'spotify:track:bench{i}',
+                'artists': [{'id': 'bench', 'name': 'Bench Artist'}],
+                'album': {'id': 'bench', 'name': 'Bench Album', 'release_date': None},
+                'popularity': 50,
+                'preview_url': None,
+                'image_url': None
+            }
+            for i in range(options['tracks'])
+        ]
+        # Bench tracks go to a throwaway catalog, since the real one is
+        # append-only, and their Track rows are deleted at the end
+        catalog_dir = tempfile.TemporaryDirectory()
+        catalog = TrackCatalog(os.path.join(catalog_dir.name, 'catalog.bin'))
+        try:
+            with mock.patch('recommender.models.track_catalog', catalog):
+                for mode in ['sync', 'buffered']:
+                    elapsed, errors = self._run(mode, user, tracks, options)
+                    written = options['threads'] * options['records'] - errors
+                    self.stdout.write(
+                        f"{mode:>8}: {written} records in {elapsed:.2f}s "
+                        f"({written / elapsed:.0f} records/s, {errors} errors)"
+                    )
+        finally:
+            user.delete()
+            Track.objects.filter(id__in=[track['id'] for track in tracks]).delete()
+            catalog_dir.cleanup()
+
+    def _run(self, mode, user, tracks, options):
+        buffer = HistoryWriteBuffer(max_size=options['buffer_size'])
+        errors = []
+
+        def work():
+            try:
+                for _ in range(options['records']):
+                    history = RecommendationHistory(user=user, prompt='bench')
+                    history.set_tracks(tracks)
+                    try:
+                        if mode == 'buffered':
+                            buffer.add(history)
+                        else:
+                            history.save()
+                    except Exception:
+                        errors.append(1)
+            finally:
+                close_old_connections()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=work) for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        buffer.shutdown()
+        elapsed = time.perf_counter() - started
+        return elapsed, len(errors)
@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+# Runs in a fresh interpreter so nothing is already imported or cached
+PROBE = """
+import json, time
+started = time.perf_counter()
+import django
+django.setup()
+setup_done = time.perf_counter()
+import recommender.views
+import_done = time.perf_counter()
+from django.test import Client
+client = Client(HTTP_HOST='localhost')
+first_started = time.perf_counter()
+client.get('/')
+first_done = time.perf_counter()
+client.get('/')
+second_done = time.perf_counter()
+print(json.dumps({
+    'setup': setup_done - started,
+    'import_views': import_done - setup_done,
+    'first_request': first_done - first_started,
+    'second_request': second_done - first_done,
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Benchmark process startup and first-request latency, with and without STARTUP_WARMUP."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        for warmup in ['False', 'True']:
+            runs = [self._probe(warmup) for _ in range(options['runs'])]
+            self.stdout.write(f"STARTUP_WARMUP={warmup} (median of {len(runs)} runs)")
+            for name in ['setup', 'import_views', 'first_request', 'second_request']:
+                values = sorted(run[name] for run in runs)
+                self.stdout.write(f"  {name:>15}: {values[len(values) // 2] * 1000:.1f}ms")
+
+    def _probe(self, warmup):
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'spotify_recommender.settings'),
+            'STARTUP_WARMUP': warmup,
+        }
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
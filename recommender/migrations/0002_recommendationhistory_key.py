@@ -0,0 +1,31 @@
+import uuid
+
+from django.db import migrations, models
+
+
+def populate_keys(apps, schema_editor):
+    RecommendationHistory = apps.get_model("recommender", "RecommendationHistory")
+    for history in RecommendationHistory.objects.all().only("id"):
+        history.key = uuid.uuid4()
+        history.save(update_fields=["key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recommendationhistory",
+            name="key",
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(populate_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="recommendationhistory",
+            name="key",
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.10 on 2026-10-19 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0002_recommendationhistory_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recommendationhistory",
+            name="spotify_playlist_id",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="recommendationhistory",
+            name="spotify_snapshot_id",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
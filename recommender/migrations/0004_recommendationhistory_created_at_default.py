@@ -0,0 +1,19 @@
+# Generated by Django 4.2.10 on 2026-10-19 09:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0003_recommendationhistory_spotify_playlist"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="recommendationhistory",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,47 @@
+import json
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_catalog_tracks(apps, schema_editor):
+    # Entries written since the catalog was introduced only hold track ids;
+    # copy those tracks from this host's catalog file into the database
+    from recommender.catalog import TrackCatalog
+
+    RecommendationHistory = apps.get_model("recommender", "RecommendationHistory")
+    Track = apps.get_model("recommender", "Track")
+    track_ids = set()
+    for tracks in RecommendationHistory.objects.values_list("tracks", flat=True):
+        tracks = json.loads(tracks)
+        if tracks and isinstance(tracks[0], str):
+            track_ids.update(tracks)
+    if not track_ids:
+        return
+    catalog = TrackCatalog(settings.TRACK_CATALOG_PATH)
+    Track.objects.bulk_create(
+        [
+            Track(id=track["id"], data=json.dumps(track, separators=(",", ":")))
+            for track in catalog.get_many(sorted(track_ids))
+            if track is not None
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0004_recommendationhistory_created_at_default"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Track",
+            fields=[
+                ("id", models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ("data", models.TextField()),
+            ],
+        ),
+        migrations.RunPython(copy_catalog_tracks, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils.functional import cached_property
+from django.utils import timezone
 from django.contrib.auth.models import User
 import json
+import logging
+import uuid
+
+from .catalog import track_catalog
+
+
+logger = logging.getLogger(__name__)
 
 
 class UserProfile(models.Model):
@@ -14,17 +23,111 @@ class UserProfile(models.Model):
         return f"{self.user.username}'s profile"
 
 
+class Track(models.Model):
+    """
+    Track metadata referenced by history entries, one row per Spotify track.
+    The track catalog caches these rows in a file shared by the workers on
+    a host and is refilled from here when it lacks a track.
+    """
+    id = models.CharField(max_length=64, primary_key=True)
+    data = models.TextField()  # Track dict as compact JSON
+    
+    def __str__(self):
+        return self.id
+    
+    @classmethod
+    def store(cls, tracks):
+        """
+        Insert or update the given track dicts; the last one per id wins.
+        """
+        rows = {
+            track['id']: cls(id=track['id'], data=json.dumps(track, separators=(',', ':')))
+            for track in tracks
+        }
+        if rows:
+            cls.objects.bulk_create(
+                rows.values(), update_conflicts=True, unique_fields=['id'], update_fields=['data']
+            )
+    
+    @classmethod
+    def get_many(cls, track_ids):
+        """
+        Return the track dicts for track_ids, in order. Tracks this host's
+        catalog lacks are loaded from the database and added to it.
+        """
+        tracks = track_catalog.get_many(track_ids)
+        missing = [track_id for track_id, track in zip(track_ids, tracks) if track is None]
+        if missing:
+            stored = {
+                track_id: json.loads(data)
+                for track_id, data in cls.objects.filter(id__in=missing).values_list('id', 'data')
+            }
+            track_catalog.add_many(list(stored.values()))
+            lost = [track_id for track_id in missing if track_id not in stored]
+            if lost:
+                logger.warning(
+                    "%d of %d tracks missing from the database: %s",
+                    len(lost), len(track_ids), ', '.join(lost[:5])
+                )
+            tracks = [track or stored.get(track_id) for track_id, track in zip(track_ids, tracks)]
+        return [track for track in tracks if track is not None]
+
+
 class RecommendationHistory(models.Model):
+    # Assigned before the row is written so links work while the record
+    # is still queued in the history write buffer
+    key = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     prompt = models.CharField(max_length=255)
-    created_at = models.DateTimeField(auto_now_add=True)
-    tracks = models.TextField()  # JSON string of recommended tracks
+    # Set when the record is built, not when the history buffer writes it
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    tracks = models.TextField()  # JSON list of Track ids
+    # Spotify playlist exported from this entry, kept in sync on re-export
+    spotify_playlist_id = models.CharField(max_length=255, blank=True, null=True)
+    spotify_snapshot_id = models.CharField(max_length=255, blank=True, null=True)
     
     def __str__(self):
         return f"{self.user.username} - {self.prompt} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
     
     def get_tracks(self):
-        return json.loads(self.tracks)
+        tracks = json.loads(self.tracks)
+        # Older entries hold the full track dicts instead of Track ids
+        if tracks and isinstance(tracks[0], str):
+            return Track.get_many(tracks)
+        return tracks
+    
+    @cached_property
+    def tracks_list(self):
+        # Lazy so a cached history fragment never loads a deferred tracks column
+        return self.get_tracks()
     
     def set_tracks(self, tracks_list):
-        self.tracks = json.dumps(tracks_list)
\ No newline at end of file
+        self.tracks = json.dumps([track['id'] for track in tracks_list])
+        # Written to the Track table together with this entry
+        self._new_tracks = list(tracks_list)
+        track_catalog.add_many(tracks_list)
+    
+    @classmethod
+    def store_new_tracks(cls, histories):
+        """
+        Write the tracks set on unsaved entries. bulk_create() skips save(),
+        so callers inserting entries in bulk call this in the same transaction.
+        """
+        Track.store([track for history in histories for track in getattr(history, '_new_tracks', [])])
+    
+    def save(self, *args, **kwargs):
+        if not getattr(self, '_new_tracks', None):
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            self.store_new_tracks([self])
+            super().save(*args, **kwargs)
+        self._new_tracks = []
+    
+    def get_track_uris(self):
+        # Entries hold either library tracks or playlist items wrapping one
+        uris = []
+        for track in self.get_tracks():
+            track = track.get('track', track) or {}
+            if track.get('uri'):
+                uris.append(track['uri'])
+        return uris
\ No newline at end of file
@@ -1,5 +1,14 @@
-from typing import List, Dict, Any, Set
-from icecream import ic
+from typing import List, Dict, Any, Set, Tuple
+from django.conf import settings
+
+
+def _ic():
+    """
+    Return icecream's ic, imported on first use so production workers
+    never load it.
+    """
+    from icecream import ic
+    return ic
 
 class Constants:
     """
@@ -32,6 +41,15 @@ class Constants:
         'night': ['night', 'evening', 'dark', 'late', 'moon']
     }
 
+    # (trigger words, keywords) pairs tried in order when no mood matches
+    FALLBACK_MAPPINGS: List[Tuple[List[str], List[str]]] = [
+        (['energetic', 'energy', 'up', 'fast', 'quick'], ['energy', 'power', 'fast', 'beat']),
+        (['calm', 'slow', 'down', 'quiet', 'peaceful'], ['calm', 'peace', 'gentle', 'soft']),
+        (['happy', 'joy', 'positive', 'fun'], ['happy', 'joy', 'fun', 'smile']),
+        (['sad', 'negative', 'melancholy', 'unhappy'], ['sad', 'blue', 'heartbreak']),
+        (['dance', 'dancing', 'groove'], ['dance', 'groove', 'rhythm', 'beat']),
+    ]
+
 class BaseRecommender:
     """
     Base class for all recommenders.
@@ -53,11 +71,32 @@ class MoodMusicRecommender(BaseRecommender):
     Recommends music tracks based on user mood and preferences.
     Inherits from BaseRecommender.
     """
+    _mood_table: List[Tuple[str, frozenset]] = []
+    _fallback_table: List[Tuple[Tuple[str, ...], frozenset]] = []
+
     def __init__(self, library: List[Dict[str, Any]]):
         """
         Initialize with a user's music library.
         """
         super().__init__(library)
+        if not self._mood_table:
+            self.prepare()
+
+    @classmethod
+    def prepare(cls) -> None:
+        """
+        Build the keyword lookup tables from Constants.
+        Called from RecommenderConfig.ready() so workers don't pay for it
+        on their first request.
+        """
+        cls._mood_table = [
+            (mood, frozenset(keywords))
+            for mood, keywords in Constants.KEYWORD_MAPPINGS.items()
+        ]
+        cls._fallback_table = [
+            (tuple(triggers), frozenset(keywords))
+            for triggers, keywords in Constants.FALLBACK_MAPPINGS
+        ]
 
     def recommend(self, prompt: str, max_results: int = 15) -> List[Dict[str, Any]]:
         """
@@ -87,21 +126,15 @@ class MoodMusicRecommender(BaseRecommender):
         Extract relevant keywords from the prompt using predefined mappings.
         """
         matched_keywords = set()
-        for mood, keywords in Constants.KEYWORD_MAPPINGS.items():
+        for mood, keywords in self._mood_table:
             if mood in prompt:
                 matched_keywords.update(keywords)
         # Fallback for more general moods
         if not matched_keywords:
-            if any(word in prompt for word in ['energetic', 'energy', 'up', 'fast', 'quick']):
-                matched_keywords.update(['energy', 'power', 'fast', 'beat'])
-            elif any(word in prompt for word in ['calm', 'slow', 'down', 'quiet', 'peaceful']):
-                matched_keywords.update(['calm', 'peace', 'gentle', 'soft'])
-            elif any(word in prompt for word in ['happy', 'joy', 'positive', 'fun']):
-                matched_keywords.update(['happy', 'joy', 'fun', 'smile'])
-            elif any(word in prompt for word in ['sad', 'negative', 'melancholy', 'unhappy']):
-                matched_keywords.update(['sad', 'blue', 'heartbreak'])
-            elif any(word in prompt for word in ['dance', 'dancing', 'groove']):
-                matched_keywords.update(['dance', 'groove', 'rhythm', 'beat'])
+            for triggers, keywords in self._fallback_table:
+                if any(word in prompt for word in triggers):
+                    matched_keywords.update(keywords)
+                    break
         return matched_keywords
 
     def _score_track(self, track: Dict[str, Any], matched_keywords: Set[str]) -> int:
@@ -111,7 +144,8 @@ class MoodMusicRecommender(BaseRecommender):
         score = 0
         name = track['name'].lower()
         artists = [artist['name'].lower() for artist in track['artists']]
-        ic(name, artists)
+        if settings.DEBUG:
+            _ic()(name, artists)
         for keyword in matched_keywords:
             if keyword in name:
                 score += 2  # Higher weight for track name
@@ -0,0 +1,75 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Any
+
+from django.conf import settings
+
+from ..spotify.api import search_playlists_by_mood, get_tracks_from_playlist, get_track_info
+
+
+# Shared by all requests so concurrent recommendations can't spawn
+# unbounded numbers of threads. Sized so every concurrent request gets
+# its own max_playlists slots instead of queueing behind slower ones
+_executor = ThreadPoolExecutor(
+    max_workers=settings.RECOMMEND_FANOUT_WORKERS, thread_name_prefix='playlist-fanout'
+)
+
+
+def rank_playlist_tracks(playlists: List[List[Dict[str, Any]]], max_results: int = 10) -> List[Dict[str, Any]]:
+    """
+    Merge playlist items from several playlists into one ranked list.
+
+    Items are deduplicated by track id and ordered by how many playlists
+    contain the track, then by popularity. Ties keep the order in which
+    tracks were first seen.
+    """
+    counts = Counter()
+    first_seen: Dict[str, Dict[str, Any]] = {}
+    for items in playlists:
+        seen_here = set()
+        for item in items:
+            track = item.get('track') if item else None
+            if not track or not track.get('id') or track['id'] in seen_here:
+                continue
+            seen_here.add(track['id'])
+            counts[track['id']] += 1
+            first_seen.setdefault(track['id'], item)
+
+    ranked = sorted(
+        first_seen.values(),
+        key=lambda item: (counts[item['track']['id']], item['track'].get('popularity') or 0),
+        reverse=True
+    )
+    return ranked[:max_results]
+
+
+def recommend_from_playlists(access_token: str, prompt: str, max_results: int = 10,
+                             max_playlists: int = 5, tracks_per_playlist: int = 50,
+                             deadline: float = 3.0) -> List[Dict[str, Any]]:
+    """
+    Recommend tracks from several playlists matching the prompt.
+
+    Tracks of up to max_playlists search results are fetched concurrently.
+    The whole call, search included, is held to `deadline` seconds: the
+    requests are given only the time left, and whatever has arrived by
+    then is ranked while slower playlists are left out. Tracks are
+    returned in the shape of get_track_info().
+    """
+    started = time.monotonic()
+    playlist_ids = search_playlists_by_mood(access_token, prompt, timeout=deadline)[:max_playlists]
+    remaining = deadline - (time.monotonic() - started)
+    if not playlist_ids or remaining <= 0:
+        return []
+
+    futures = [
+        _executor.submit(get_tracks_from_playlist, access_token, playlist_id, tracks_per_playlist, remaining)
+        for playlist_id in playlist_ids
+    ]
+    done, not_done = wait(futures, timeout=remaining)
+    for future in not_done:
+        future.cancel()
+
+    # Keep search order so ties favour the better-matching playlists
+    playlists = [future.result() for future in futures if future in done and not future.exception()]
+    return [get_track_info(item['track']) for item in rank_playlist_tracks(playlists, max_results)]
@@ -1,5 +1,75 @@
+import os
 import requests
 import random
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .coalesce import spotify_flight
+
+# Shared across calls so requests reuse pooled keep-alive connections
+session = requests.Session()
+
+
+class SpotifyAPIError(Exception):
+    """
+    A Spotify API call failed in a way the caller shouldn't paper over.
+    """
+
+
+class SpotifyTokenError(SpotifyAPIError):
+    """
+    Spotify rejected the caller's access token (401/403), so the same call
+    may still succeed with another user's token.
+    """
+
+
+def _raise_for_status(response, action):
+    error = SpotifyTokenError if response.status_code in [401, 403] else SpotifyAPIError
+    raise error(f"Error {response.status_code} {action}: {response.text}")
+
+
+def _reset_session_pool():
+    # A forked worker must not reuse keep-alive sockets opened by its parent
+    session.mount('https://', requests.adapters.HTTPAdapter())
+    session.mount('http://', requests.adapters.HTTPAdapter())
+
+
+os.register_at_fork(after_in_child=_reset_session_pool)
+
+
+def conditional_get(url, headers, params=None, parse=None, scope='', timeout=None):
+    """
+    GET a Spotify resource, revalidating a cached copy with If-None-Match.
+
+    parse turns the JSON body into what callers need; the parsed result is
+    cached with the response ETag, so a 304 costs neither the download nor
+    the decode. scope separates cache entries for per-user resources.
+    Returns (response, data), where data is None unless the request
+    succeeded or was answered from the cache.
+    """
+    key = hashlib.sha1(repr((url, sorted((params or {}).items()), scope)).encode()).hexdigest()
+    key = f'spotify:etag:{key}'
+    cached = cache.get(key)
+    
+    if cached:
+        headers = {**headers, 'If-None-Match': cached['etag']}
+    
+    response = session.get(url, headers=headers, params=params, timeout=timeout)
+    
+    if response.status_code == 304 and cached:
+        return response, cached['data']
+    
+    if response.status_code != 200:
+        return response, None
+    
+    data = parse(response.json()) if parse else response.json()
+    
+    if response.headers.get('ETag'):
+        cache.set(key, {'etag': response.headers['ETag'], 'data': data}, settings.SPOTIFY_ETAG_CACHE_TIMEOUT)
+    
+    return response, data
 
 
 def get_user_profile(access_token):
@@ -10,7 +80,7 @@ def get_user_profile(access_token):
         'Authorization': f'Bearer {access_token}'
     }
     
-    response = requests.get(
+    response = session.get(
         'https://api.spotify.com/v1/me',
         headers=headers
     )
@@ -18,9 +88,38 @@ def get_user_profile(access_token):
     return response.json() if response.status_code == 200 else None
 
 
-def get_user_library(access_token, limit=50):
+def get_track_info(track):
+    """
+    Extract the track information we keep from a Spotify track object.
+    """
+    return {
+        'id': track['id'],
+        'name': track['name'],
+        'uri': track['uri'],
+        'artists': [{'id': artist['id'], 'name': artist['name']} for artist in track['artists']],
+        'album': {
+            'id': track['album']['id'],
+            'name': track['album']['name'],
+            'release_date': track['album'].get('release_date')
+        },
+        'popularity': track.get('popularity', 0),
+        'preview_url': track.get('preview_url'),
+        'image_url': track['album']['images'][0]['url'] if track['album'].get('images') else None
+    }
+
+
+def _parse_library_page(data):
+    return {
+        'total': data['total'],
+        'tracks': [get_track_info(item['track']) for item in data['items']]
+    }
+
+
+def get_user_library(access_token, spotify_id, limit=50):
     """
     Get tracks from the user's Spotify library.
+    spotify_id scopes the cached pages to the user, so they survive token
+    refreshes without ever being served to someone else.
     """
     headers = {
         'Authorization': f'Bearer {access_token}'
@@ -33,38 +132,18 @@ def get_user_library(access_token, limit=50):
     # Spotify API allows a maximum of 50 items per request
     # We'll paginate to get more items
     while total is None or offset < total:
-        response = requests.get(
+        response, data = conditional_get(
             f'https://api.spotify.com/v1/me/tracks?limit={limit}&offset={offset}',
-            headers=headers
+            headers,
+            parse=_parse_library_page,
+            scope=f'user:{spotify_id}'
         )
         
-        if response.status_code != 200:
+        if data is None:
             break
         
-        data = response.json()
         total = data['total']
-        
-        # Process each saved track
-        for item in data['items']:
-            track = item['track']
-            
-            # Extract relevant track information
-            track_info = {
-                'id': track['id'],
-                'name': track['name'],
-                'uri': track['uri'],
-                'artists': [{'id': artist['id'], 'name': artist['name']} for artist in track['artists']],
-                'album': {
-                    'id': track['album']['id'],
-                    'name': track['album']['name'],
-                    'release_date': track['album']['release_date']
-                },
-                'popularity': track['popularity'],
-                'preview_url': track['preview_url'],
-                'image_url': track['album']['images'][0]['url'] if track['album']['images'] else None
-            }
-            
-            tracks.append(track_info)
+        tracks.extend(data['tracks'])
         
         offset += limit
         
@@ -91,7 +170,7 @@ def create_spotify_playlist(access_token, user_id, name, description=""):
         'public': True
     }
     
-    response = requests.post(
+    response = session.post(
         f'https://api.spotify.com/v1/users/{user_id}/playlists',
         headers=headers,
         json=data
@@ -103,10 +182,24 @@ def create_spotify_playlist(access_token, user_id, name, description=""):
 import requests
 import urllib.parse
 
-def search_playlist_by_mood(access_token, mood, max_results=10):
+def search_playlists_by_mood(access_token, mood, max_results=10, timeout=None):
     """
-    Search for playlists by mood on Spotify.
+    Search for playlists by mood on Spotify and return their ids.
+    Identical concurrent searches share one upstream request.
     """
+    # Search results don't depend on whose token is used; a token failure
+    # isn't shared, waiting callers retry with their own
+    key = ('search_playlists', ' '.join(mood.lower().split()), max_results)
+    try:
+        return spotify_flight.do(
+            key, _search_playlists_by_mood, access_token, mood, max_results, timeout,
+            retry_on=SpotifyTokenError
+        )
+    except (SpotifyAPIError, requests.exceptions.RequestException) as e:
+        print(e)
+        return []
+
+def _search_playlists_by_mood(access_token, mood, max_results, timeout):
     headers = {
         'Authorization': f'Bearer {access_token}',
     }
@@ -117,39 +210,61 @@ def search_playlist_by_mood(access_token, mood, max_results=10):
         'limit': max_results
     }
 
-    response = requests.get(
+    response = session.get(
         'https://api.spotify.com/v1/search',
         headers=headers,
-        params=params
+        params=params,
+        timeout=timeout
     )
 
     if response.status_code == 200:
         items = response.json()
         items = items.get('playlists', {}).get('items', [])
-        items = list(filter(lambda x: x, items))
-        return random.choice(items).get('id', None) if items else None
+        return [item['id'] for item in items if item and item.get('id')]
          
     else:
-        print(f"Error {response.status_code}: {response.text}")
-        return None
+        _raise_for_status(response, 'searching playlists')
 
-def get_tracks_from_playlist(access_token, playlist_id, max_tracks=10):
+def search_playlist_by_mood(access_token, mood, max_results=10):
+    """
+    Pick one random playlist matching the mood on Spotify.
+    """
+    playlist_ids = search_playlists_by_mood(access_token, mood, max_results)
+    return random.choice(playlist_ids) if playlist_ids else None
+
+def get_tracks_from_playlist(access_token, playlist_id, max_tracks=10, timeout=None):
+    """
+    Get the first max_tracks items of a playlist.
+    Identical concurrent reads share one upstream request.
+    """
+    key = ('playlist_tracks', playlist_id, max_tracks)
+    try:
+        return spotify_flight.do(
+            key, _get_tracks_from_playlist, access_token, playlist_id, max_tracks, timeout,
+            retry_on=SpotifyTokenError
+        )
+    except (SpotifyAPIError, requests.exceptions.RequestException) as e:
+        print(e)
+        return []
+
+def _get_tracks_from_playlist(access_token, playlist_id, max_tracks, timeout):
     headers = {
         'Authorization': f'Bearer {access_token}',
     }
     params = {
         'limit': max_tracks
     }
-    response = requests.get(
+    response, items = conditional_get(
         f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks',
-        headers=headers,
-        params=params
+        headers,
+        params=params,
+        parse=lambda data: data.get('items', []),
+        timeout=timeout
     )
-    if response.status_code == 200:
-        return response.json().get('items', [])
+    if items is not None:
+        return items
     else:
-        print("Error getting tracks:", response.status_code, response.text)
-        return []    
+        _raise_for_status(response, 'getting tracks')
     
 def add_tracks_to_playlist(access_token, playlist_id, track_uris):
     """
@@ -170,7 +285,7 @@ def add_tracks_to_playlist(access_token, playlist_id, track_uris):
             'uris': chunk
         }
         
-        response = requests.post(
+        response = session.post(
             f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks',
             headers=headers,
             json=data
@@ -179,4 +294,135 @@ def add_tracks_to_playlist(access_token, playlist_id, track_uris):
         if response.status_code not in [200, 201]:
             return None
     
-    return response.json() if response.status_code in [200, 201] else None
\ No newline at end of file
+    return response.json() if response.status_code in [200, 201] else None
+
+def get_playlist_snapshot(access_token, playlist_id):
+    """
+    Get the current snapshot_id of a playlist, or None if it doesn't exist.
+    Raises SpotifyAPIError for any other failure, including a 403, which
+    means the token lacks access rather than that the playlist is gone.
+    """
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+    }
+    
+    response = session.get(
+        f'https://api.spotify.com/v1/playlists/{playlist_id}',
+        headers=headers,
+        params={'fields': 'snapshot_id'}
+    )
+    
+    if response.status_code == 404:
+        return None
+    
+    if response.status_code != 200:
+        _raise_for_status(response, 'reading playlist')
+    
+    return response.json().get('snapshot_id')
+
+
+def is_following_playlist(access_token, playlist_id, user_id):
+    """
+    Check whether a user still follows a playlist.
+    Deleting a playlist on Spotify only unfollows it; the playlist itself
+    stays readable, so this is how to tell it was deleted.
+    """
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+    }
+    
+    response = session.get(
+        f'https://api.spotify.com/v1/playlists/{playlist_id}/followers/contains',
+        headers=headers,
+        params={'ids': user_id}
+    )
+    
+    if response.status_code == 404:
+        return False
+    
+    if response.status_code != 200:
+        _raise_for_status(response, 'checking playlist followers')
+    
+    return bool(response.json()[0])
+
+
+def get_playlist_track_uris(access_token, playlist_id):
+    """
+    Get the URIs of all tracks in a playlist, in playlist order.
+    """
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+    }
+    
+    uris = []
+    url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'
+    params = {'fields': 'items(track(uri)),next', 'limit': 100}
+    
+    while url:
+        response = session.get(url, headers=headers, params=params)
+        
+        if response.status_code != 200:
+            return None
+        
+        data = response.json()
+        uris.extend(item['track']['uri'] for item in data['items'] if item.get('track'))
+        # 'next' already carries the query string
+        url = data.get('next')
+        params = None
+    
+    return uris
+
+
+def remove_tracks_from_playlist(access_token, playlist_id, track_uris):
+    """
+    Remove every occurrence of the given tracks from a Spotify playlist.
+    """
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json'
+    }
+    
+    # Spotify API has a limit of 100 tracks per request
+    max_tracks_per_request = 100
+    
+    for i in range(0, len(track_uris), max_tracks_per_request):
+        chunk = track_uris[i:i + max_tracks_per_request]
+        
+        data = {
+            'tracks': [{'uri': uri} for uri in chunk]
+        }
+        
+        response = session.delete(
+            f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks',
+            headers=headers,
+            json=data
+        )
+        
+        if response.status_code != 200:
+            return None
+    
+    return response.json()
+
+
+def reorder_playlist_tracks(access_token, playlist_id, range_start, insert_before, range_length=1):
+    """
+    Move a range of tracks within a Spotify playlist.
+    """
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json'
+    }
+    
+    data = {
+        'range_start': range_start,
+        'insert_before': insert_before,
+        'range_length': range_length
+    }
+    
+    response = session.put(
+        f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks',
+        headers=headers,
+        json=data
+    )
+    
+    return response.json() if response.status_code == 200 else None
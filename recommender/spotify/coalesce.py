@@ -0,0 +1,123 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls into one upstream call.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for and share its result (or exception). Threaded
+    callers use do() and async callers use do_async(); both share the same
+    in-flight table, so a coroutine can piggyback on a call a worker thread
+    started and vice versa. Shared results must be treated as read-only.
+
+    Exceptions listed in retry_on are specific to the caller that hit them
+    (e.g. its token was revoked). A waiting caller that receives one runs
+    the function again itself instead of sharing the failure.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._tasks = set()
+        self._calls = 0
+        self._coalesced = 0
+        self._retries = 0
+
+    def do(self, key, fn, *args, retry_on=(), **kwargs):
+        """
+        Run fn(*args, **kwargs) unless an identical call is in flight.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                return future.result()
+            except retry_on:
+                self._retried()
+                return fn(*args, **kwargs)
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self._leave(key)
+        return future.result()
+
+    async def do_async(self, key, fn, *args, retry_on=(), **kwargs):
+        """
+        Async counterpart of do(). fn may be a coroutine function or a
+        blocking function, which is then run in a worker thread.
+
+        The call runs in a task of its own, so cancelling the caller that
+        started it (e.g. when its client disconnects) doesn't cancel it
+        for the callers waiting on it.
+        """
+        future, leader = self._join(key)
+        if leader:
+            task = asyncio.ensure_future(self._call_async(fn, *args, **kwargs))
+            # The event loop only keeps weak references to tasks
+            self._tasks.add(task)
+            task.add_done_callback(lambda task: self._settle(key, future, task))
+            return await asyncio.wrap_future(future)
+        try:
+            return await asyncio.wrap_future(future)
+        except retry_on:
+            self._retried()
+            return await self._call_async(fn, *args, **kwargs)
+
+    @staticmethod
+    async def _call_async(fn, *args, **kwargs):
+        if asyncio.iscoroutinefunction(fn):
+            return await fn(*args, **kwargs)
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    def stats(self):
+        """
+        Return how many upstream calls were made and how many were saved.
+        """
+        with self._lock:
+            return {
+                'calls': self._calls,
+                'coalesced': self._coalesced - self._retries,
+                'retried': self._retries,
+                'in_flight': len(self._in_flight),
+            }
+
+    def _join(self, key):
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return future, False
+            future = Future()
+            # Only the call itself settles the future; a cancelled waiter
+            # must not cancel it for everyone else
+            future.set_running_or_notify_cancel()
+            self._in_flight[key] = future
+            self._calls += 1
+            return future, True
+
+    def _settle(self, key, future, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            # Only happens when the event loop shuts down; waiters get an
+            # error of their own rather than a CancelledError
+            future.set_exception(RuntimeError(f"Coalesced call {key!r} was cancelled"))
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+        self._leave(key)
+
+    def _retried(self):
+        with self._lock:
+            self._calls += 1
+            self._retries += 1
+
+    def _leave(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+
+spotify_flight = SingleFlight()
@@ -0,0 +1,148 @@
+from collections import Counter
+from bisect import bisect_left
+
+from .api import (
+    SpotifyAPIError,
+    get_playlist_snapshot,
+    is_following_playlist,
+    get_playlist_track_uris,
+    add_tracks_to_playlist,
+    remove_tracks_from_playlist,
+    reorder_playlist_tracks
+)
+
+
+def _tag(uris):
+    """
+    Pair each URI with its occurrence number so duplicates stay distinct.
+    """
+    seen = Counter()
+    tagged = []
+    for uri in uris:
+        tagged.append((uri, seen[uri]))
+        seen[uri] += 1
+    return tagged
+
+
+def _longest_increasing(seq):
+    """
+    Return the indices of one longest strictly increasing subsequence.
+    """
+    tails = []
+    tail_indices = []
+    previous = [None] * len(seq)
+    for i, value in enumerate(seq):
+        k = bisect_left(tails, value)
+        if k == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[k] = value
+            tail_indices[k] = i
+        previous[i] = tail_indices[k - 1] if k else None
+
+    indices = []
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        indices.append(i)
+        i = previous[i]
+    return indices[::-1]
+
+
+def plan_playlist_changes(current, desired):
+    """
+    Work out the edits that turn the current track list into the desired one.
+
+    Returns (removals, additions, moves). Removals are URIs to delete (Spotify
+    removes every occurrence), additions are URIs to append afterwards, and
+    moves are (range_start, insert_before, range_length) triples to apply in
+    order. Only the tracks outside the longest already-ordered run are moved,
+    and tracks that are already adjacent move together.
+    """
+    desired_counts = Counter(desired)
+    current_counts = Counter(current)
+
+    removals = [uri for uri in current_counts if current_counts[uri] > desired_counts[uri]]
+    removed = set(removals)
+    remaining = [uri for uri in current if uri not in removed]
+
+    remaining_counts = Counter(remaining)
+    additions = []
+    for uri in desired:
+        if remaining_counts[uri] < desired_counts[uri]:
+            additions.append(uri)
+            remaining_counts[uri] += 1
+
+    target = _tag(desired)
+    position = {item: i for i, item in enumerate(target)}
+    order = _tag(remaining + additions)
+    stable = {order[i] for i in _longest_increasing([position[item] for item in order])}
+
+    moves = []
+    t = 0
+    while t < len(target):
+        if target[t] in stable:
+            t += 1
+            continue
+        range_start = order.index(target[t])
+        length = 1
+        while (t + length < len(target) and target[t + length] not in stable
+               and range_start + length < len(order) and order[range_start + length] == target[t + length]):
+            length += 1
+        items = order[range_start:range_start + length]
+        del order[range_start:range_start + length]
+        new_index = order.index(target[t - 1]) + 1 if t else 0
+        order[new_index:new_index] = items
+        # insert_before counts positions before the tracks are lifted out
+        insert_before = new_index if new_index <= range_start else new_index + length
+        moves.append((range_start, insert_before, length))
+        t += length
+
+    return removals, additions, moves
+
+
+def sync_playlist(access_token, user_id, playlist_id, track_uris, snapshot_id=None):
+    """
+    Update an existing Spotify playlist to hold exactly track_uris.
+
+    If the playlist still has the snapshot_id we last saw nothing is sent.
+    Otherwise only the minimal removals, additions and moves are sent.
+    Returns the resulting snapshot_id, or None if the playlist is gone or
+    the user deleted (unfollowed) it. Raises SpotifyAPIError if any read or
+    update fails, which may leave the playlist partially updated; retrying
+    the sync finishes the job.
+    """
+    if not is_following_playlist(access_token, playlist_id, user_id):
+        return None
+
+    current_snapshot = get_playlist_snapshot(access_token, playlist_id)
+
+    if current_snapshot is None or current_snapshot == snapshot_id:
+        return current_snapshot
+
+    current = get_playlist_track_uris(access_token, playlist_id)
+
+    if current is None:
+        raise SpotifyAPIError("Failed to read playlist tracks")
+
+    removals, additions, moves = plan_playlist_changes(current, track_uris)
+
+    if removals:
+        result = remove_tracks_from_playlist(access_token, playlist_id, removals)
+        if result is None:
+            raise SpotifyAPIError("Failed to remove playlist tracks")
+        current_snapshot = result['snapshot_id']
+
+    if additions:
+        result = add_tracks_to_playlist(access_token, playlist_id, additions)
+        if result is None:
+            raise SpotifyAPIError("Failed to add playlist tracks")
+        current_snapshot = result['snapshot_id']
+
+    for range_start, insert_before, range_length in moves:
+        result = reorder_playlist_tracks(access_token, playlist_id, range_start, insert_before, range_length)
+        if result is None:
+            raise SpotifyAPIError("Failed to reorder playlist tracks")
+        current_snapshot = result['snapshot_id']
+
+    return current_snapshot
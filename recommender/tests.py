@@ -0,0 +1,623 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from .catalog import TrackCatalog, track_catalog
+from .history_buffer import HistoryWriteBuffer
+from .models import UserProfile, RecommendationHistory, Track
+from .recommendation.playlists import rank_playlist_tracks, recommend_from_playlists
+from .spotify.api import SpotifyAPIError, SpotifyTokenError, get_playlist_snapshot, get_user_library
+from .spotify.coalesce import SingleFlight
+from .spotify.sync import plan_playlist_changes, sync_playlist
+
+
+# A tiny cache, so fragments get evicted between page loads
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5},
+    }
+}
+
+TRACK = {
+    'id': 'track1',
+    'name': 'Happy Song',
+    'uri': 'spotify:track:track1',
+    'artists': [{'id': 'artist1', 'name': 'Artist'}],
+    'album': {'id': 'album1', 'name': 'Album', 'release_date': '2020-01-01'},
+    'popularity': 50,
+    'preview_url': None,
+    'image_url': None
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RecommendQueryCountTests(TestCase):
+    """
+    An authenticated recommendation must not regress to extra session,
+    user or profile queries.
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='listener')
+        UserProfile.objects.create(user=self.user, spotify_id='listener', access_token='token')
+
+        catalog_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(catalog_dir.cleanup)
+        patches = [
+            mock.patch.object(track_catalog, 'path', os.path.join(catalog_dir.name, 'catalog.bin')),
+            mock.patch('recommender.views.recommend_from_playlists', return_value=[TRACK]),
+            # History is written by the buffer's own thread, outside the request
+            mock.patch('recommender.views.history_buffer.add'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def login(self):
+        self.client.force_login(self.user, backend='recommender.backends.ProfileModelBackend')
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_db_sessions_use_two_queries(self):
+        # Session, then user and profile together
+        self.login()
+        with self.assertNumQueries(2):
+            response = self.client.post('/recommend/', {'prompt': 'happy'})
+        self.assertContains(response, 'Happy Song')
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_cached_sessions_use_one_query(self):
+        # Session comes from the cache; user and profile in one query
+        self.login()
+        with self.assertNumQueries(1):
+            response = self.client.post('/recommend/', {'prompt': 'happy'})
+        self.assertContains(response, 'Happy Song')
+
+
+class HistoryWriteBufferTests(TransactionTestCase):
+    """
+    The buffer writes from its own thread, so rows are checked outside a
+    test transaction.
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='listener')
+
+    def make_buffer(self, **kwargs):
+        buffer = HistoryWriteBuffer(**kwargs)
+        self.addCleanup(buffer.shutdown)
+        return buffer
+
+    def make_history(self, **kwargs):
+        return RecommendationHistory(**{'user': self.user, 'prompt': 'happy', 'tracks': '[]', **kwargs})
+
+    def wait_for_rows(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while RecommendationHistory.objects.count() < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(RecommendationHistory.objects.count(), count)
+
+    def test_full_buffer_is_written_without_waiting(self):
+        buffer = self.make_buffer(max_size=3, flush_interval=60)
+        for _ in range(3):
+            buffer.add(self.make_history())
+        self.wait_for_rows(3)
+
+    def test_records_are_written_after_flush_interval(self):
+        buffer = self.make_buffer(max_size=100, flush_interval=0.05)
+        buffer.add(self.make_history())
+        self.wait_for_rows(1)
+
+    def test_shutdown_writes_pending_records(self):
+        buffer = self.make_buffer(max_size=100, flush_interval=60)
+        buffer.add(self.make_history())
+        buffer.add(self.make_history())
+        self.assertEqual(RecommendationHistory.objects.count(), 0)
+        buffer.shutdown()
+        self.assertEqual(RecommendationHistory.objects.count(), 2)
+
+    def test_key_and_created_at_are_set_before_write(self):
+        buffer = self.make_buffer(max_size=100, flush_interval=60)
+        history = buffer.add(self.make_history())
+        key, created_at = history.key, history.created_at
+        buffer.shutdown()
+        saved = RecommendationHistory.objects.get(key=key)
+        self.assertEqual(saved.created_at, created_at)
+
+    def test_bulk_write_stores_tracks(self):
+        buffer = self.make_buffer(max_size=100, flush_interval=60)
+        catalog_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(catalog_dir.cleanup)
+        with mock.patch('recommender.models.track_catalog', TrackCatalog(os.path.join(catalog_dir.name, 'catalog.bin'))):
+            history = self.make_history()
+            history.set_tracks([TRACK])
+            buffer.add(history)
+            buffer.flush()
+        self.assertTrue(Track.objects.filter(id='track1').exists())
+
+    def test_locked_database_is_retried(self):
+        buffer = self.make_buffer(max_size=100, flush_interval=60)
+        buffer.add(self.make_history())
+        with mock.patch.object(
+            RecommendationHistory.objects, 'bulk_create', side_effect=OperationalError("database is locked")
+        ), self.assertLogs('recommender.history_buffer', 'WARNING'):
+            buffer.flush()
+        self.assertEqual(buffer.pending_count(), 1)
+        self.assertGreater(buffer._backoff, 0)
+        buffer.flush()
+        self.assertEqual(RecommendationHistory.objects.count(), 1)
+        self.assertEqual(buffer._backoff, 0)
+
+    def test_rejected_record_is_dropped(self):
+        buffer = self.make_buffer(max_size=100, flush_interval=60)
+        key = uuid.uuid4()
+        buffer.add(self.make_history(key=key, prompt='first'))
+        buffer.add(self.make_history(key=key, prompt='duplicate'))
+        with self.assertLogs('recommender.history_buffer', 'ERROR'):
+            buffer.flush()
+        self.assertEqual(buffer.pending_count(), 0)
+        self.assertEqual(RecommendationHistory.objects.get(key=key).prompt, 'first')
+
+
+class CreatePlaylistSyncTests(TestCase):
+    """
+    Re-exporting must only create a new playlist when the old one is gone.
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='listener')
+        UserProfile.objects.create(user=self.user, spotify_id='listener', access_token='token')
+        self.history = RecommendationHistory.objects.create(
+            user=self.user,
+            prompt='happy',
+            tracks='[{"uri": "spotify:track:track1"}]',
+            spotify_playlist_id='playlist1',
+            spotify_snapshot_id='snapshot1'
+        )
+        self.client.force_login(self.user, backend='recommender.backends.ProfileModelBackend')
+
+    def export(self):
+        return self.client.get(f'/create-playlist/{self.history.key}/')
+
+    @override_settings(HISTORY_WRITE_BEHIND=True)
+    def test_unknown_entry_may_still_be_saving(self):
+        response = self.client.get(f'/create-playlist/{uuid.uuid4()}/', follow=True)
+        self.assertContains(response, 'still being saved')
+
+    @mock.patch('recommender.views.create_spotify_playlist')
+    @mock.patch('recommender.views.sync_playlist', side_effect=SpotifyAPIError("Error 503"))
+    def test_failed_sync_keeps_playlist(self, sync_playlist, create_spotify_playlist):
+        self.export()
+        create_spotify_playlist.assert_not_called()
+        self.history.refresh_from_db()
+        self.assertEqual(self.history.spotify_playlist_id, 'playlist1')
+
+    @mock.patch('recommender.views.add_tracks_to_playlist', return_value={'snapshot_id': 'snapshot2'})
+    @mock.patch('recommender.views.create_spotify_playlist', return_value={'id': 'playlist2'})
+    @mock.patch('recommender.views.sync_playlist', return_value=None)
+    def test_missing_playlist_is_recreated(self, sync_playlist, create_spotify_playlist, add_tracks_to_playlist):
+        self.export()
+        self.history.refresh_from_db()
+        self.assertEqual(self.history.spotify_playlist_id, 'playlist2')
+        self.assertEqual(self.history.spotify_snapshot_id, 'snapshot2')
+
+
+def playlist_item(track_id, popularity=50):
+    return {'track': {**TRACK, 'id': track_id, 'popularity': popularity, 'album': {**TRACK['album'], 'images': []}}}
+
+
+class RankPlaylistTracksTests(TestCase):
+    def ranked_ids(self, playlists, max_results=10):
+        return [item['track']['id'] for item in rank_playlist_tracks(playlists, max_results)]
+
+    def test_tracks_are_deduplicated(self):
+        playlists = [[playlist_item('a'), playlist_item('a')], [playlist_item('a')]]
+        self.assertEqual(self.ranked_ids(playlists), ['a'])
+
+    def test_tracks_in_more_playlists_rank_first_then_by_popularity(self):
+        playlists = [
+            [playlist_item('a', 90), playlist_item('b', 10), playlist_item('c', 50)],
+            [playlist_item('b', 10), playlist_item('d', 50)],
+        ]
+        self.assertEqual(self.ranked_ids(playlists), ['b', 'a', 'c', 'd'])
+
+    def test_empty_items_are_skipped_and_results_capped(self):
+        playlists = [[None, {'track': None}, playlist_item('a'), playlist_item('b'), playlist_item('c')]]
+        self.assertEqual(self.ranked_ids(playlists, max_results=2), ['a', 'b'])
+
+
+class RecommendDeadlineTests(TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def get_tracks(self, access_token, playlist_id, max_tracks, timeout):
+        if playlist_id == 'slow':
+            self.release.wait()
+        return [playlist_item(playlist_id)]
+
+    @mock.patch('recommender.recommendation.playlists.search_playlists_by_mood', return_value=['fast', 'slow'])
+    def test_slow_playlists_are_left_out(self, search_playlists_by_mood):
+        with mock.patch('recommender.recommendation.playlists.get_tracks_from_playlist', self.get_tracks):
+            started = time.monotonic()
+            tracks = recommend_from_playlists('token', 'happy', deadline=0.2)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual([track['id'] for track in tracks], ['fast'])
+        self.assertEqual(search_playlists_by_mood.call_args.kwargs['timeout'], 0.2)
+
+    def test_slow_search_uses_up_the_budget(self):
+        def search(access_token, prompt, timeout):
+            time.sleep(0.05)
+            return ['fast']
+
+        with mock.patch('recommender.recommendation.playlists.search_playlists_by_mood', search), \
+                mock.patch('recommender.recommendation.playlists.get_tracks_from_playlist') as get_tracks:
+            self.assertEqual(recommend_from_playlists('token', 'happy', deadline=0.01), [])
+        get_tracks.assert_not_called()
+
+
+def apply_playlist_changes(current, removals, additions, moves):
+    """
+    Apply a plan the way Spotify does: removals drop every occurrence, and
+    insert_before counts positions before the range is lifted out.
+    """
+    tracks = [uri for uri in current if uri not in removals] + additions
+    for range_start, insert_before, range_length in moves:
+        moved = tracks[range_start:range_start + range_length]
+        del tracks[range_start:range_start + range_length]
+        if insert_before > range_start:
+            insert_before -= range_length
+        tracks[insert_before:insert_before] = moved
+    return tracks
+
+
+class PlanPlaylistChangesTests(TestCase):
+    def assertPlanReaches(self, current, desired):
+        plan = plan_playlist_changes(current, desired)
+        self.assertEqual(apply_playlist_changes(current, *plan), desired)
+        return plan
+
+    def test_unchanged_playlist_needs_nothing(self):
+        self.assertEqual(self.assertPlanReaches(['a', 'b', 'c'], ['a', 'b', 'c']), ([], [], []))
+
+    def test_removed_tracks_are_deleted(self):
+        removals, additions, moves = self.assertPlanReaches(['a', 'b', 'c', 'b'], ['a', 'c'])
+        self.assertEqual((removals, additions, moves), (['b'], [], []))
+
+    def test_new_tracks_are_appended(self):
+        removals, additions, moves = self.assertPlanReaches(['a', 'b'], ['a', 'b', 'c'])
+        self.assertEqual((removals, additions, moves), ([], ['c'], []))
+
+    def test_duplicates_are_reordered(self):
+        removals, additions, moves = self.assertPlanReaches(['a', 'b', 'a'], ['a', 'a', 'b'])
+        self.assertEqual((removals, additions), ([], []))
+        self.assertEqual(len(moves), 1)
+
+    def test_fewer_duplicates_are_removed_and_readded(self):
+        # Spotify can only remove every occurrence of a track
+        removals, additions, moves = self.assertPlanReaches(['a', 'b', 'a'], ['b', 'a'])
+        self.assertEqual((removals, additions, moves), (['a'], ['a'], []))
+
+    def test_adjacent_tracks_move_as_one_range(self):
+        removals, additions, moves = self.assertPlanReaches(['a', 'b', 'c', 'd', 'e'], ['d', 'e', 'a', 'b', 'c'])
+        self.assertEqual(moves, [(3, 0, 2)])
+
+    def test_random_playlists_reach_desired_order(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            current = [rng.choice('abcdefgh') for _ in range(rng.randint(0, 12))]
+            desired = [rng.choice('abcdefgh') for _ in range(rng.randint(0, 12))]
+            self.assertPlanReaches(current, desired)
+
+
+@mock.patch('recommender.spotify.sync.get_playlist_snapshot', return_value='snapshot1')
+@mock.patch('recommender.spotify.sync.is_following_playlist', return_value=True)
+class SyncPlaylistTests(TestCase):
+    def test_unchanged_snapshot_sends_nothing(self, is_following_playlist, get_playlist_snapshot):
+        with mock.patch('recommender.spotify.sync.get_playlist_track_uris') as get_playlist_track_uris:
+            self.assertEqual(sync_playlist('token', 'listener', 'playlist1', [], 'snapshot1'), 'snapshot1')
+        get_playlist_track_uris.assert_not_called()
+
+    def test_unfollowed_playlist_is_gone(self, is_following_playlist, get_playlist_snapshot):
+        # Deleting a playlist on Spotify only unfollows it; it stays readable
+        is_following_playlist.return_value = False
+        self.assertIsNone(sync_playlist('token', 'listener', 'playlist1', [], 'snapshot1'))
+        get_playlist_snapshot.assert_not_called()
+
+
+class PlaylistSnapshotTests(TestCase):
+    @mock.patch('recommender.spotify.api.session.get')
+    def test_missing_playlist_has_no_snapshot(self, get):
+        get.return_value = mock.Mock(status_code=404, text='Not found')
+        self.assertIsNone(get_playlist_snapshot('token', 'playlist1'))
+
+    @mock.patch('recommender.spotify.api.session.get')
+    def test_forbidden_playlist_is_an_error(self, get):
+        # A 403 is a scope or token problem, not a deleted playlist
+        get.return_value = mock.Mock(status_code=403, text='Forbidden')
+        with self.assertRaises(SpotifyAPIError):
+            get_playlist_snapshot('token', 'playlist1')
+
+
+class TrackCatalogTests(TestCase):
+    def setUp(self):
+        catalog_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(catalog_dir.cleanup)
+        self.path = os.path.join(catalog_dir.name, 'catalog.bin')
+        self.catalog = TrackCatalog(self.path)
+
+    def test_tracks_are_shared_between_instances(self):
+        self.catalog.add_many([TRACK, TRACK])
+        other = TrackCatalog(self.path)
+        self.assertEqual(other.get_many(['track1']), [TRACK])
+        self.assertEqual(len(other), 1)
+
+    def test_changed_metadata_replaces_old_record(self):
+        self.catalog.add_many([TRACK])
+        TrackCatalog(self.path).add_many([{**TRACK, 'popularity': 80}])
+        self.assertEqual(self.catalog.get('track1')['popularity'], 80)
+
+    def test_missing_ids_are_none(self):
+        self.catalog.add_many([TRACK])
+        self.assertEqual(self.catalog.get_many(['track1', 'lost']), [TRACK, None])
+
+    def test_half_written_record_is_cut_off(self):
+        self.catalog.add_many([TRACK])
+        # A writer killed mid-append leaves part of a record behind
+        with open(self.path, 'ab') as f:
+            f.write(b'\x40\x00\x00\x00\x06trac')
+        other = TrackCatalog(self.path)
+        with self.assertLogs('recommender.catalog', 'WARNING'):
+            other.add_many([{**TRACK, 'id': 'track2'}, {**TRACK, 'id': 'track3'}])
+        self.assertEqual(self.catalog.get('track2')['id'], 'track2')
+        self.assertEqual(self.catalog.get('track3')['id'], 'track3')
+        self.assertEqual(len(TrackCatalog(self.path)), 3)
+
+    def test_truncated_file_is_reindexed(self):
+        self.catalog.add_many([TRACK])
+        os.truncate(self.path, 0)
+        with self.assertLogs('recommender.catalog', 'ERROR'):
+            self.assertIsNone(self.catalog.get('track1'))
+
+
+class HistoryTracksTests(TestCase):
+    """
+    The database holds history tracks; the catalog file only caches them.
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='listener')
+        catalog_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(catalog_dir.cleanup)
+        self.catalog_path = os.path.join(catalog_dir.name, 'catalog.bin')
+        patch = mock.patch('recommender.models.track_catalog', TrackCatalog(self.catalog_path))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def save_history(self, tracks):
+        history = RecommendationHistory(user=self.user, prompt='happy')
+        history.set_tracks(tracks)
+        history.save()
+        return RecommendationHistory.objects.get(pk=history.pk)
+
+    def test_tracks_are_saved_with_the_entry(self):
+        self.save_history([TRACK])
+        self.assertEqual(json.loads(Track.objects.get(id='track1').data), TRACK)
+
+    def test_lost_catalog_is_refilled_from_database(self):
+        history = self.save_history([TRACK])
+        os.remove(self.catalog_path)
+        with mock.patch('recommender.models.track_catalog', TrackCatalog(self.catalog_path)):
+            self.assertEqual(history.get_tracks(), [TRACK])
+        self.assertEqual(TrackCatalog(self.catalog_path).get('track1'), TRACK)
+
+    def test_newer_metadata_replaces_stored_track(self):
+        self.save_history([TRACK])
+        self.save_history([{**TRACK, 'popularity': 80}])
+        self.assertEqual(json.loads(Track.objects.get(id='track1').data)['popularity'], 80)
+
+    def test_tracks_missing_everywhere_are_logged(self):
+        history = RecommendationHistory(user=self.user, prompt='happy', tracks='["track1", "lost"]')
+        Track.store([TRACK])
+        with self.assertLogs('recommender.models', 'WARNING'):
+            self.assertEqual(history.get_tracks(), [TRACK])
+
+
+class SingleFlightTests(TestCase):
+    def run_concurrently(self, flight, fn, tokens, **kwargs):
+        release = threading.Event()
+        results = {}
+
+        def call(token):
+            try:
+                results[token] = flight.do('key', fn, token, release, **kwargs)
+            except Exception as e:
+                results[token] = e
+
+        threads = [threading.Thread(target=call, args=(token,)) for token in tokens]
+        threads[0].start()
+        while not flight.stats()['in_flight']:
+            pass
+        for thread in threads[1:]:
+            thread.start()
+        while flight.stats()['calls'] + flight.stats()['coalesced'] < len(tokens):
+            pass
+        release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_share_one_result(self):
+        calls = []
+
+        def fetch(token, release):
+            calls.append(token)
+            release.wait()
+            return ['playlist']
+
+        flight = SingleFlight()
+        results = self.run_concurrently(flight, fetch, ['a', 'b', 'c'])
+        self.assertEqual(calls, ['a'])
+        self.assertEqual(results, {'a': ['playlist'], 'b': ['playlist'], 'c': ['playlist']})
+        self.assertEqual(flight.stats()['coalesced'], 2)
+
+    def test_token_failure_is_retried_with_own_token(self):
+        def fetch(token, release):
+            release.wait()
+            if token == 'revoked':
+                raise SpotifyTokenError("Error 401")
+            return [token]
+
+        results = self.run_concurrently(SingleFlight(), fetch, ['revoked', 'valid'], retry_on=SpotifyTokenError)
+        self.assertIsInstance(results['revoked'], SpotifyTokenError)
+        self.assertEqual(results['valid'], ['valid'])
+
+
+class AsyncSingleFlightTests(TestCase):
+    async def wait_in_flight(self, flight):
+        while not flight.stats()['in_flight']:
+            await asyncio.sleep(0)
+
+    async def test_concurrent_calls_share_one_result(self):
+        flight = SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def fetch(token):
+            calls.append(token)
+            await release.wait()
+            return ['playlist']
+
+        tasks = [asyncio.ensure_future(flight.do_async('key', fetch, token)) for token in 'abc']
+        await self.wait_in_flight(flight)
+        await asyncio.sleep(0)
+        release.set()
+        self.assertEqual(await asyncio.gather(*tasks), [['playlist']] * 3)
+        self.assertEqual(calls, ['a'])
+
+    async def test_cancelled_caller_does_not_cancel_waiters(self):
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return ['playlist']
+
+        leader = asyncio.ensure_future(flight.do_async('key', fetch))
+        await self.wait_in_flight(flight)
+        follower = asyncio.ensure_future(flight.do_async('key', fetch))
+        await asyncio.sleep(0)
+        # e.g. the leader's client disconnected
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        self.assertEqual(await follower, ['playlist'])
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        self.assertEqual(flight.stats()['calls'], 1)
+
+    async def test_async_caller_shares_threaded_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        results = []
+
+        def fetch(token):
+            release.wait()
+            return [token]
+
+        thread = threading.Thread(target=lambda: results.append(flight.do('key', fetch, 'thread')))
+        thread.start()
+        self.addCleanup(release.set)
+        await self.wait_in_flight(flight)
+        waiter = asyncio.ensure_future(flight.do_async('key', fetch, 'async'))
+        while not flight.stats()['coalesced']:
+            await asyncio.sleep(0)
+        release.set()
+        self.assertEqual(await waiter, ['thread'])
+        await asyncio.to_thread(thread.join)
+        self.assertEqual(results, [['thread']])
+
+    async def test_token_failure_is_retried_with_own_token(self):
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fetch(token):
+            await release.wait()
+            if token == 'revoked':
+                raise SpotifyTokenError("Error 401")
+            return [token]
+
+        revoked = asyncio.ensure_future(flight.do_async('key', fetch, 'revoked', retry_on=SpotifyTokenError))
+        await self.wait_in_flight(flight)
+        valid = asyncio.ensure_future(flight.do_async('key', fetch, 'valid', retry_on=SpotifyTokenError))
+        await asyncio.sleep(0)
+        release.set()
+        with self.assertRaises(SpotifyTokenError):
+            await revoked
+        self.assertEqual(await valid, ['valid'])
+        self.assertEqual(flight.stats()['retried'], 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LibraryConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.page = {
+            'total': 1,
+            'items': [{'track': {**TRACK, 'album': {**TRACK['album'], 'images': []}}}]
+        }
+
+    def response(self, status_code, etag=None):
+        return mock.Mock(status_code=status_code, headers={'ETag': etag} if etag else {}, json=lambda: self.page)
+
+    @mock.patch('recommender.spotify.api.session.get')
+    def test_etag_survives_token_refresh(self, get):
+        get.side_effect = [self.response(200, '"v1"'), self.response(304)]
+        get_user_library('old-token', 'listener')
+        tracks = get_user_library('new-token', 'listener')
+        self.assertEqual(get.call_args.kwargs['headers']['If-None-Match'], '"v1"')
+        self.assertEqual([track['id'] for track in tracks], ['track1'])
+
+    @mock.patch('recommender.spotify.api.session.get')
+    def test_pages_are_not_shared_between_users(self, get):
+        get.side_effect = [self.response(200, '"v1"'), self.response(200, '"v2"')]
+        get_user_library('token', 'listener')
+        get_user_library('token', 'someone-else')
+        self.assertNotIn('If-None-Match', get.call_args.kwargs['headers'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HistoryFragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create(username='listener')
+        for i in range(8):
+            RecommendationHistory.objects.create(
+                user=self.user,
+                prompt=f'prompt {i}',
+                tracks=f'[{{"name": "Track {i}", "artists": []}}]'
+            )
+        self.client.force_login(self.user, backend='recommender.backends.ProfileModelBackend')
+
+    def test_evicted_fragments_are_rendered_with_tracks(self):
+        # More entries than the cache holds, so fragments get evicted between loads
+        for _ in range(3):
+            response = self.client.get('/history/')
+            for i in range(8):
+                self.assertContains(response, f'Track {i}')
+
+    def test_cached_entries_skip_loading_tracks(self):
+        RecommendationHistory.objects.filter(id__gt=RecommendationHistory.objects.order_by('id')[4].id).delete()
+        self.client.get('/history/')
+        with self.assertNumQueries(3):
+            response = self.client.get('/history/')
+        self.assertContains(response, 'Track 0')
@@ -9,5 +9,6 @@ urlpatterns = [
     path('callback/', views.spotify_callback, name='spotify_callback'),
     path('recommend/', views.recommend, name='recommend'),
     path('history/', views.history, name='history'),
-    path('create-playlist/<int:history_id>/', views.create_playlist, name='create_playlist'),
+    path('create-playlist/<uuid:history_key>/', views.create_playlist, name='create_playlist'),
+    path('stats/spotify/', views.spotify_stats, name='spotify_stats'),
 ]
\ No newline at end of file
@@ -1,6 +1,7 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.utils import timezone
@@ -9,17 +10,20 @@ from django.http import JsonResponse
 from datetime import timedelta
 import json
 import uuid
-from .recommendation.engine import MoodMusicRecommender
 from .models import UserProfile, RecommendationHistory
+from .history_buffer import history_buffer
+from .backends import get_request_profile
+from .recommendation.playlists import recommend_from_playlists
 from .spotify.auth import get_spotify_auth_url, get_spotify_tokens
 from .spotify.api import (
     get_user_profile, 
     get_user_library, 
     create_spotify_playlist,
     add_tracks_to_playlist,
-    search_playlist_by_mood,
-    get_tracks_from_playlist
+    SpotifyAPIError
 )
+from .spotify.sync import sync_playlist
+from .spotify.coalesce import spotify_flight
 
 
 def home(request):
@@ -94,7 +98,7 @@ def spotify_callback(request):
 
     request.user = user
     request._cached_user = user  # Update the request user
-    login(request, user)
+    login(request, user, backend='recommender.backends.ProfileModelBackend')
     
     messages.success(request, "Successfully connected to Spotify!")
     return redirect('home')
@@ -111,7 +115,7 @@ def recommend(request):
             return redirect('recommend')
         
         try:
-            user_profile = UserProfile.objects.get(user=request.user)
+            user_profile = get_request_profile(request)
             
             # Check if token is expired and refresh if needed
             if user_profile.token_expires_at and user_profile.token_expires_at <= timezone.now():
@@ -120,9 +124,18 @@ def recommend(request):
                 return redirect('connect_spotify')
             
             # Get user library from Spotify
-            # library = get_user_library(user_profile.access_token)
-            playlist_id = search_playlist_by_mood(user_profile.access_token, prompt)
-            tracks = get_tracks_from_playlist(user_profile.access_token, playlist_id)
+            # library = get_user_library(user_profile.access_token, user_profile.spotify_id)
+            tracks = recommend_from_playlists(
+                user_profile.access_token,
+                prompt,
+                max_results=settings.RECOMMEND_MAX_TRACKS,
+                max_playlists=settings.RECOMMEND_PLAYLISTS,
+                deadline=settings.RECOMMEND_DEADLINE
+            )
+            
+            if not tracks:
+                messages.error(request, "Couldn't find recommendations for that prompt. Please try again.")
+                return redirect('recommend')
             
             # Save recommendation to history
             history = RecommendationHistory(
@@ -130,12 +143,15 @@ def recommend(request):
                 prompt=prompt
             )
             history.set_tracks(tracks)
-            history.save()
+            if settings.HISTORY_WRITE_BEHIND:
+                history_buffer.add(history)
+            else:
+                history.save()
             
             return render(request, 'recommender/recommendations.html', {
                 'prompt': prompt,
                 'tracks': tracks,
-                'history_id': history.id
+                'history_key': history.key
             })
         
         except UserProfile.DoesNotExist:
@@ -152,12 +168,19 @@ def recommend(request):
 def history(request):
     """Show recommendation history."""
     try:
-        histories = RecommendationHistory.objects.filter(user=request.user).order_by('-created_at')
-        
-        for history in histories:
-            history.tracks_list = history.get_tracks()
+        # Make sure entries still queued in this worker's write buffer show
+        # up; entries queued by another worker appear once it flushes them
+        # (within HISTORY_FLUSH_INTERVAL)
+        history_buffer.flush()
+        # Entries never change once created, so each one is rendered once and
+        # served from the fragment cache after that. Tracks are deferred and
+        # only loaded by history.tracks_list when a fragment has to be rendered.
+        histories = RecommendationHistory.objects.filter(user=request.user).order_by('-created_at').defer('tracks')
         
-        return render(request, 'recommender/history.html', {'histories': histories})
+        return render(request, 'recommender/history.html', {
+            'histories': histories,
+            'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT
+        })
     
     except Exception as e:
         messages.error(request, f"An error occurred: {str(e)}")
@@ -165,12 +188,32 @@ def history(request):
 
 
 @login_required
-def create_playlist(request, history_id):
-    """Create a Spotify playlist from recommendations."""
+def create_playlist(request, history_key):
+    """Create a Spotify playlist from recommendations, or sync the one already created."""
     try:
-        history = RecommendationHistory.objects.get(id=history_id, user=request.user)
-        tracks = history.get_tracks()
-        user_profile = UserProfile.objects.get(user=request.user)
+        history_buffer.flush()
+        history = RecommendationHistory.objects.get(key=history_key, user=request.user)
+        track_uris = history.get_track_uris()
+        user_profile = get_request_profile(request)
+        
+        # Bring an already exported playlist up to date instead of creating another
+        if history.spotify_playlist_id:
+            snapshot_id = sync_playlist(
+                user_profile.access_token,
+                user_profile.spotify_id,
+                history.spotify_playlist_id,
+                track_uris,
+                history.spotify_snapshot_id
+            )
+            
+            # None means the playlist is gone or the user deleted it; only
+            # then make a new one
+            if snapshot_id is not None:
+                if snapshot_id != history.spotify_snapshot_id:
+                    history.spotify_snapshot_id = snapshot_id
+                    history.save(update_fields=['spotify_snapshot_id'])
+                messages.success(request, "Playlist is up to date!")
+                return redirect('history')
         
         # Create playlist on Spotify
         playlist_name = f"Recommended: {history.prompt}"
@@ -181,22 +224,36 @@ def create_playlist(request, history_id):
             f"Songs recommended for prompt: {history.prompt}"
         )
         
-        if 'id' in playlist:
+        if playlist and 'id' in playlist:
             # Add tracks to playlist
-            track_uris = [track['uri'] for track in tracks]
             result = add_tracks_to_playlist(user_profile.access_token, playlist['id'], track_uris)
             
-            if 'snapshot_id' in result:
+            if result and 'snapshot_id' in result:
+                history.spotify_playlist_id = playlist['id']
+                history.spotify_snapshot_id = result['snapshot_id']
+                history.save(update_fields=['spotify_playlist_id', 'spotify_snapshot_id'])
                 messages.success(request, "Playlist created successfully!")
                 return redirect('history')
         
         messages.error(request, "Failed to create playlist. Please try again.")
         
     except RecommendationHistory.DoesNotExist:
-        messages.error(request, "Recommendation not found.")
+        if settings.HISTORY_WRITE_BEHIND:
+            # The entry may still be queued in another worker's write buffer
+            messages.error(request, "This recommendation is still being saved or doesn't exist. Please try again in a few seconds.")
+        else:
+            messages.error(request, "Recommendation not found.")
+    except SpotifyAPIError:
+        messages.error(request, "Couldn't update your Spotify playlist. Please try again.")
     except UserProfile.DoesNotExist:
         messages.error(request, "Please connect your Spotify account first.")
     except Exception as e:
         messages.error(request, f"An error occurred: {str(e)}")
     
-    return redirect('history')
\ No newline at end of file
+    return redirect('history')
+
+
+@staff_member_required
+def spotify_stats(request):
+    """Report how many Spotify calls were saved by request coalescing."""
+    return JsonResponse(spotify_flight.stats())
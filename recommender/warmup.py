@@ -0,0 +1,42 @@
+import requests
+from django.template.loader import get_template
+
+from .spotify.api import session
+
+
+TEMPLATE_NAMES = [
+    'recommender/base.html',
+    'recommender/home.html',
+    'recommender/recommend_form.html',
+    'recommender/recommendations.html',
+    'recommender/history.html',
+]
+
+
+def precompile_templates():
+    """
+    Load every app template so the cached loader holds the compiled
+    versions before the first request.
+    """
+    for name in TEMPLATE_NAMES:
+        get_template(name)
+
+
+def open_http_pool():
+    """
+    Open a keep-alive connection to the Spotify API so the first request
+    doesn't pay for DNS and the TLS handshake.
+    """
+    try:
+        session.head('https://api.spotify.com/v1/', timeout=5)
+    except requests.RequestException as e:
+        print(f"Could not pre-open Spotify connection: {e}")
+
+
+def warm_up():
+    """
+    Prepare a worker before it starts accepting traffic.
+    Must run in the worker process itself, after any fork.
+    """
+    precompile_templates()
+    open_http_pool()
@@ -104,8 +104,69 @@ SPOTIFY_CLIENT_ID = config('SPOTIFY_CLIENT_ID', default='')
 SPOTIFY_CLIENT_SECRET = config('SPOTIFY_CLIENT_SECRET', default='')
 SPOTIFY_REDIRECT_URI = config('SPOTIFY_REDIRECT_URI', default='http://127.0.0.1:8000/callback/')
 
+# Recommendation history is queued and written in batches by a background
+# thread instead of one INSERT per request. Each worker has its own queue, so
+# with several workers a new entry can take up to HISTORY_FLUSH_INTERVAL
+# seconds to show up in requests served by another worker
+HISTORY_WRITE_BEHIND = config('HISTORY_WRITE_BEHIND', default=True, cast=bool)
+HISTORY_BUFFER_SIZE = config('HISTORY_BUFFER_SIZE', default=50, cast=int)
+HISTORY_FLUSH_INTERVAL = config('HISTORY_FLUSH_INTERVAL', default=2.0, cast=float)
+
+# Prompt recommendations merge tracks from several matching playlists,
+# fetched concurrently and cut off after RECOMMEND_DEADLINE seconds. The
+# fetch pool holds RECOMMEND_PLAYLISTS threads for each of the
+# RECOMMEND_CONCURRENCY requests a worker process serves at once (e.g.
+# gunicorn --threads)
+RECOMMEND_MAX_TRACKS = config('RECOMMEND_MAX_TRACKS', default=10, cast=int)
+RECOMMEND_PLAYLISTS = config('RECOMMEND_PLAYLISTS', default=5, cast=int)
+RECOMMEND_CONCURRENCY = config('RECOMMEND_CONCURRENCY', default=4, cast=int)
+RECOMMEND_FANOUT_WORKERS = config(
+    'RECOMMEND_FANOUT_WORKERS', default=RECOMMEND_PLAYLISTS * RECOMMEND_CONCURRENCY, cast=int
+)
+RECOMMEND_DEADLINE = config('RECOMMEND_DEADLINE', default=3.0, cast=float)
+
+# How long parsed Spotify responses are kept for If-None-Match revalidation
+SPOTIFY_ETAG_CACHE_TIMEOUT = config('SPOTIFY_ETAG_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Rendered history entries and recommendation grids never change, so their
+# template fragments can be cached for a long time
+FRAGMENT_CACHE_TIMEOUT = config('FRAGMENT_CACHE_TIMEOUT', default=86400, cast=int)
+
+# Append-only file caching track metadata for all workers on this host.
+# The Track table stays the source of truth; a lost file is refilled from it
+TRACK_CATALOG_PATH = config('TRACK_CATALOG_PATH', default=str(BASE_DIR / 'track_catalog.bin'))
+
+# Precompile templates at startup and, under gunicorn (see gunicorn.conf.py),
+# open the Spotify connection pool in each worker; leave off for manage.py
+STARTUP_WARMUP = config('STARTUP_WARMUP', default=False, cast=bool)
+
+# Load the UserProfile together with the user on every authenticated request
+AUTHENTICATION_BACKENDS = [
+    'recommender.backends.ProfileModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 # Session settings
 SESSION_COOKIE_AGE = 86400  # 24 hours in seconds
+# Use 'django.contrib.sessions.backends.cached_db' to serve session reads from
+# CACHES; the database stays the fallback, so evicted sessions aren't lost
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.db')
+
+# Holds cached sessions, Spotify ETags and rendered history fragments. The
+# default is a bounded cache per worker process; set CACHE_BACKEND to Redis
+# or Memcached (e.g. django.core.cache.backends.redis.RedisCache) to share
+# it between workers and hosts
+CACHE_BACKEND = config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+if CACHE_BACKEND == 'django.core.cache.backends.locmem.LocMemCache':
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=5000, cast=int),
+    }
 
 LOGGING = {
     'version': 1,